@@ -1,17 +1,21 @@
+import functools
 import os
-import tempfile
 import re
 import urllib.parse
-from collections import defaultdict
+from typing import Any, Dict
 
 import requests
+from cachecontrol import CacheControl
+from cachecontrol.caches import FileCache
+
+PROPERTIES_CACHE_DIR = os.path.expanduser('~/.cache/ce-props')
 
 
 def get_specific_library_version_details(libraries, libid, libraryVersion):
-    if 'versionprops' in libraries[libid]:
-        for verid in libraries[libid]['versionprops']:
-            versionProps = libraries[libid]['versionprops'][verid]
-            if versionProps['version'] == libraryVersion or versionProps['lookupversion'] == libraryVersion:
+    library = libraries.get(libid, {})
+    if 'versionprops' in library:
+        for versionProps in library['versionprops'].values():
+            if versionProps.get('version') == libraryVersion or versionProps.get('lookupversion') == libraryVersion:
                 return versionProps
 
     return False
@@ -19,157 +23,139 @@ def get_specific_library_version_details(libraries, libid, libraryVersion):
 
 COMPILEROPT_RE = re.compile(r'(\w*)\.(.*)\.(\w*)')
 
+
+@functools.lru_cache(maxsize=1)
+def properties_session() -> requests.Session:
+    return CacheControl(requests.Session(), cache=FileCache(PROPERTIES_CACHE_DIR))
+
+
 def get_properties_compilers_and_libraries(language, logger):
-    _compilers = defaultdict(lambda: [])
-    _libraries = defaultdict(lambda: [])
+    _compilers: Dict[str, Dict[str, Any]] = {}
+    _libraries: Dict[str, Dict[str, Any]] = {}
 
     encoded_language = urllib.parse.quote(language)
     url = f'https://raw.githubusercontent.com/compiler-explorer/compiler-explorer/main/etc/config/{encoded_language}.amazon.properties'
-    lines = []
-    with tempfile.TemporaryFile() as fd:
-        request = requests.get(url, stream=True)
-        if not request.ok:
-            raise RuntimeError(f'Fetch failure for {url}: {request}')
-        for chunk in request.iter_content(chunk_size=4 * 1024 * 1024):
-            fd.write(chunk)
-        fd.flush()
-        fd.seek(0)
-        lines = fd.readlines()
-
-    logger.debug('Reading properties for groups')
-    groups = defaultdict(lambda: [])
-    for line in lines:
-        sline = line.decode('utf-8').rstrip('\n')
-        if sline.startswith('group.'):
-            keyval = sline.split('=', 1)
-            key = keyval[0].split('.')
-            val = keyval[1]
-            group = key[1]
-            if not group in groups:
-                groups[group] = defaultdict(lambda: [])
-
-            if key[2] == "compilers":
-                groups[group]['compilers'] = val.split(':')
-            elif key[2] == "options":
-                groups[group]['options'] = val
-            elif key[2] == "compilerType":
-                groups[group]['compilerType'] = val
-            elif key[2] == "supportsBinary":
-                groups[group]['supportsBinary'] = val == 'true'
-            elif key[2] == "ldPath":
-                groups[group]['ldPath'] = val
-        elif sline.startswith('libs.'):
-            keyval = sline.split('=', 1)
-            key = keyval[0].split('.')
-            val = keyval[1]
-            libid = key[1]
-            if not libid in _libraries:
-                _libraries[libid] = defaultdict(lambda: [])
-
-            if key[2] == 'description':
-                _libraries[libid]['description'] = val
-            elif key[2] == 'name':
-                _libraries[libid]['name'] = val
-            elif key[2] == 'url':
-                _libraries[libid]['url'] = val
-            elif key[2] == 'liblink':
-                _libraries[libid]['liblink'] = val.split(':')
-            elif key[2] == 'staticliblink':
-                _libraries[libid]['staticliblink'] = val.split(':')
-            elif key[2] == 'versions':
-                if len(key) > 3:
-                    versionid = key[3]
-                    if not 'versionprops' in _libraries[libid]:
-                        _libraries[libid]['versionprops'] = defaultdict(lambda: [])
-                    if not versionid in _libraries[libid]['versionprops']:
-                        _libraries[libid]['versionprops'][versionid] = defaultdict(lambda: [])
-                    if len(key) > 4:
-                        if key[4] == 'version':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val
-                        if key[4] == 'lookupversion':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val
-                        if key[4] == 'path':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val.split(':')
-                        if key[4] == 'libpath':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val.split(':')
-                        if key[4] == 'staticliblink':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val.split(':')
-                        if key[4] == 'liblink':
-                            _libraries[libid]['versionprops'][versionid][key[4]] = val.split(':')
-                else:
-                    _libraries[libid]['versions'] = val
-
-    logger.debug('Setting default values for compilers')
-    for group in groups:
-        for compiler in groups[group]['compilers']:
-            if '&' in compiler:
-                subgroupname = compiler[1:]
-                if not 'options' in groups[subgroupname] and 'options' in groups[group]:
-                    groups[subgroupname]['options'] = groups[group]['options']
-                if not 'compilerType' in groups[subgroupname] and 'compilerType' in groups[group]:
-                    groups[subgroupname]['compilerType'] = groups[group]['compilerType']
-                if not 'supportsBinary' in groups[subgroupname] and 'supportsBinary' in groups[group]:
-                    groups[subgroupname]['supportsBinary'] = groups[group]['supportsBinary']
-                if not 'ldPath' in groups[subgroupname] and 'ldPath' in groups[group]:
-                    groups[subgroupname]['ldPath'] = groups[group]['ldPath']
-
-            if not compiler in _compilers:
-                _compilers[compiler] = defaultdict(lambda: [])
-
-            if 'options' in groups[group]:
-                _compilers[compiler]['options'] = groups[group]['options']
+    request = properties_session().get(url, stream=True)
+    if not request.ok:
+        raise RuntimeError(f'Fetch failure for {url}: {request}')
+    request.encoding = 'utf-8'
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    # compiler.* lines override the group defaults, which are only known once all groups have been read
+    compiler_overrides: Dict[str, Dict[str, Any]] = {}
+
+    def read_group_line(key_str, val):
+        key = key_str.split('.')
+        group = groups.setdefault(key[1], {})
+
+        if key[2] == "compilers":
+            group['compilers'] = val.split(':')
+        elif key[2] == "options":
+            group['options'] = val
+        elif key[2] == "compilerType":
+            group['compilerType'] = val
+        elif key[2] == "supportsBinary":
+            group['supportsBinary'] = val == 'true'
+        elif key[2] == "ldPath":
+            group['ldPath'] = val
+
+    def read_library_line(key_str, val):
+        key = key_str.split('.')
+        library = _libraries.setdefault(key[1], {})
+
+        if key[2] == 'description':
+            library['description'] = val
+        elif key[2] == 'name':
+            library['name'] = val
+        elif key[2] == 'url':
+            library['url'] = val
+        elif key[2] == 'liblink':
+            library['liblink'] = val.split(':')
+        elif key[2] == 'staticliblink':
+            library['staticliblink'] = val.split(':')
+        elif key[2] == 'versions':
+            if len(key) > 3:
+                versionprops = library.setdefault('versionprops', {}).setdefault(key[3], {})
+                if len(key) > 4:
+                    if key[4] == 'version':
+                        versionprops[key[4]] = val
+                    if key[4] == 'lookupversion':
+                        versionprops[key[4]] = val
+                    if key[4] == 'path':
+                        versionprops[key[4]] = val.split(':')
+                    if key[4] == 'libpath':
+                        versionprops[key[4]] = val.split(':')
+                    if key[4] == 'staticliblink':
+                        versionprops[key[4]] = val.split(':')
+                    if key[4] == 'liblink':
+                        versionprops[key[4]] = val.split(':')
             else:
-                _compilers[compiler]['options'] = ""
+                library['versions'] = val
 
-            if 'compilerType' in groups[group]:
-                _compilers[compiler]['compilerType'] = groups[group]['compilerType']
-            else:
-                _compilers[compiler]['compilerType'] = ""
+    def read_compiler_line(key_str, val):
+        matches = COMPILEROPT_RE.match(key_str)
+        if not matches:
+            raise RuntimeError(f'Not a valid compiler? {key_str}={val}')
+        key = [matches[1], matches[2], matches[3]]
+        overrides = compiler_overrides.setdefault(key[1], {})
 
-            if 'supportsBinary' in groups[group]:
-                _compilers[compiler]['supportsBinary'] = groups[group]['supportsBinary']
-            else:
-                _compilers[compiler]['supportsBinary'] = True
+        if key[2] == "supportsBinary":
+            overrides[key[2]] = val == 'true'
+        else:
+            overrides[key[2]] = val
 
-            if 'ldPath' in groups[group]:
-                _compilers[compiler]['ldPath'] = groups[group]['ldPath']
-            else:
-                _compilers[compiler]['ldPath'] = ""
-
-            _compilers[compiler]['group'] = group
-
-    logger.debug('Reading properties for compilers')
-    for line in lines:
-        sline = line.decode('utf-8').rstrip('\n')
-        if sline.startswith('compiler.'):
-            keyval = sline.split('=', 1)
-            matches = COMPILEROPT_RE.match(keyval[0])
-            if not matches:
-                raise RuntimeError(f'Not a valid compiler? {keyval}')
-            key = [matches[1], matches[2], matches[3]]
-            val = keyval[1]
-            if not key[1] in _compilers:
-                _compilers[key[1]] = defaultdict(lambda: [])
-
-            if key[2] == "supportsBinary":
-                _compilers[key[1]][key[2]] = val == 'true'
-            else:
-                _compilers[key[1]][key[2]] = val
+    line_readers = {
+        'group': read_group_line,
+        'libs': read_library_line,
+        'compiler': read_compiler_line,
+    }
+
+    logger.debug('Reading properties for groups and libraries')
+    for sline in request.iter_lines(chunk_size=65536, decode_unicode=True):
+        key_str, _, val = sline.partition('=')
+        prefix, dot, _ = key_str.partition('.')
+        if dot and prefix in line_readers:
+            line_readers[prefix](key_str, val)
+
+    logger.debug('Setting default values for compilers')
+    for groupname, group in list(groups.items()):
+        for compiler in group.get('compilers', []):
+            if '&' in compiler:
+                subgroup = groups.setdefault(compiler[1:], {})
+                if not 'options' in subgroup and 'options' in group:
+                    subgroup['options'] = group['options']
+                if not 'compilerType' in subgroup and 'compilerType' in group:
+                    subgroup['compilerType'] = group['compilerType']
+                if not 'supportsBinary' in subgroup and 'supportsBinary' in group:
+                    subgroup['supportsBinary'] = group['supportsBinary']
+                if not 'ldPath' in subgroup and 'ldPath' in group:
+                    subgroup['ldPath'] = group['ldPath']
+
+            compilerprops = _compilers.setdefault(compiler, {})
+            compilerprops['options'] = group.get('options', "")
+            compilerprops['compilerType'] = group.get('compilerType', "")
+            compilerprops['supportsBinary'] = group.get('supportsBinary', True)
+            compilerprops['ldPath'] = group.get('ldPath', "")
+            compilerprops['group'] = groupname
+
+    logger.debug('Applying properties for compilers')
+    for compiler, overrides in compiler_overrides.items():
+        _compilers.setdefault(compiler, {}).update(overrides)
 
     logger.debug('Removing compilers that are not available or do not support binaries')
-    keysToRemove = defaultdict(lambda: [])
-    for compiler in _compilers:
-        if 'supportsBinary' in _compilers[compiler] and not _compilers[compiler]['supportsBinary']:
+    keysToRemove = []
+    for compiler, compilerprops in _compilers.items():
+        if 'supportsBinary' in compilerprops and not compilerprops['supportsBinary']:
             logger.debug(compiler + ' does not supportsBinary')
-            keysToRemove[compiler] = True
-        elif 'compilerType' in _compilers[compiler] and _compilers[compiler]['compilerType'] == 'wine-vc':
-            keysToRemove[compiler] = True
-        elif 'exe' in _compilers[compiler]:
-            exe = _compilers[compiler]['exe']
+            keysToRemove.append(compiler)
+        elif 'compilerType' in compilerprops and compilerprops['compilerType'] == 'wine-vc':
+            keysToRemove.append(compiler)
+        elif 'exe' in compilerprops:
+            exe = compilerprops['exe']
             if not os.path.exists(exe):
-                keysToRemove[compiler] = True
+                keysToRemove.append(compiler)
         else:
-            keysToRemove[compiler] = True
+            keysToRemove.append(compiler)
 
     for compiler in keysToRemove:
         logger.debug('removing ' + compiler)
@@ -73,6 +73,8 @@ def main():
 
     parser.add_argument('--buildfor', default='', metavar='BUILDFOR',
                         help='filter to only build for given compiler (should be a CE compiler identifier), leave empty to build for all')
+    parser.add_argument('--jobs', default=min(8, os.cpu_count() or 1), metavar='N', type=int,
+                        help='run up to N library builds in parallel (default %(default)s)')
 
     parser.add_argument('command',
                         choices=['list', 'install', 'check_installed', 'verify', 'amazoncheck', 'build', 'squash'],
@@ -153,8 +155,8 @@ def main():
 
             for libraryid in libraries:
                 logger.debug('Checking %s', libraryid)
-                for version in libraries[libraryid]['versionprops']:
-                    includepaths = libraries[libraryid]['versionprops'][version]['path']
+                for version, versionprops in libraries[libraryid].get('versionprops', {}).items():
+                    includepaths = versionprops.get('path', [])
                     for includepath in includepaths:
                         logger.debug('Checking for library %s %s: %s', libraryid, version, includepath)
                         if not os.path.exists(includepath):
@@ -162,7 +164,7 @@ def main():
                         else:
                             logger.debug('Found path for library %s %s: %s', libraryid, version, includepath)
 
-                    libpaths = libraries[libraryid]['versionprops'][version]['libpath']
+                    libpaths = versionprops.get('libpath', [])
                     for libpath in libpaths:
                         logger.debug('Checking for library %s %s: %s', libraryid, version, libpath)
                         if not os.path.exists(libpath):
@@ -227,7 +229,7 @@ def main():
                     num_skipped += 1
                 else:
                     try:
-                        [num_installed, num_skipped, num_failed] = installable.build(args.buildfor)
+                        [num_installed, num_skipped, num_failed] = installable.build(args.buildfor, args.jobs)
                         if num_installed > 0:
                             context.info(f"{installable.name} built OK")
                         elif num_failed:
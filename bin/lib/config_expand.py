@@ -1,9 +1,15 @@
-from typing import Any, MutableMapping
+import re
+from typing import Any, List, MutableMapping, Optional, Set
 
 import jinja2
 
 MAX_ITERS = 5
 
+VALUE_SCALARS = (str, bool, float, int)
+
+# The first name in a "{name...}" format field or a "{{ name ... }}" jinja expression
+TEMPLATE_REF_RE = re.compile(r'\{\{?\s*(\w+)')
+
 JINJA_ENV = jinja2.Environment()
 
 
@@ -17,24 +23,13 @@ def is_list_of_strings_or_lists(value: Any) -> bool:
 
 
 def is_value_type(value: Any) -> bool:
-    return isinstance(value, str) \
-           or isinstance(value, bool) \
-           or isinstance(value, float) \
-           or isinstance(value, int) \
-           or is_list_of_strings(value) \
-           or is_list_of_strings_or_lists(value)
+    # a list of strings is also a list of strings or lists, so one scan covers both
+    return isinstance(value, VALUE_SCALARS) or is_list_of_strings_or_lists(value)
 
 
 def needs_expansion(target):
-    for value in target.values():
-        if is_list_of_strings(value):
-            for v in value:
-                if '{' in v:
-                    return True
-        elif isinstance(value, str):
-            if '{' in value:
-                return True
-    return False
+    return any('{' in value if isinstance(value, str) else is_list_of_strings(value) and any('{' in v for v in value)
+               for value in target.values())
 
 
 def expand_one(template_string, configuration):
@@ -42,20 +37,57 @@ def expand_one(template_string, configuration):
     return jinjad.format(**configuration)
 
 
+def template_refs(value: Any) -> Set[str]:
+    if is_list_of_strings(value):
+        return {ref for v in value for ref in TEMPLATE_REF_RE.findall(v)}
+    elif isinstance(value, str):
+        return set(TEMPLATE_REF_RE.findall(value))
+    return set()
+
+
+def expansion_order(target: MutableMapping[str, Any]) -> Optional[List[str]]:
+    """Orders the keys of target so each comes after the keys it refers to, or None if the references form a cycle."""
+    pending = {key: template_refs(value) & target.keys() for key, value in target.items()}
+    order = []
+    while pending:
+        ready = [key for key, refs in pending.items() if not refs & pending.keys()]
+        if not ready:
+            return None
+        order.extend(ready)
+        for key in ready:
+            del pending[key]
+    return order
+
+
+def expand_key(target: MutableMapping[str, Any], key: str, context):
+    value = target[key]
+    try:
+        if is_list_of_strings(value):
+            target[key] = [expand_one(x, target) for x in value]
+        elif isinstance(value, str):
+            target[key] = expand_one(value, target)
+        elif isinstance(value, float):
+            target[key] = str(value)
+    except KeyError as ke:
+        raise RuntimeError(f"Unable to find key {ke} in {target[key]} (in {'/'.join(context)})") from ke
+
+
 def expand_target(target: MutableMapping[str, Any], context):
+    if not needs_expansion(target):
+        return target
+
+    # Expanding in dependency order resolves every key in a single pass...
+    order = expansion_order(target)
+    if order is not None:
+        for key in order:
+            expand_key(target, key, context)
+
+    # ...and anything left over (cycles, or templates that expand into more templates) is expanded to a fixed point
     iterations = 0
     while needs_expansion(target):
         iterations += 1
         if iterations > MAX_ITERS:
             raise RuntimeError(f"Too many mutual references (in {'/'.join(context)})")
-        for key, value in target.items():
-            try:
-                if is_list_of_strings(value):
-                    target[key] = [expand_one(x, target) for x in value]
-                elif isinstance(value, str):
-                    target[key] = expand_one(value, target)
-                elif isinstance(value, float):
-                    target[key] = str(value)
-            except KeyError as ke:
-                raise RuntimeError(f"Unable to find key {ke} in {target[key]} (in {'/'.join(context)})") from ke
+        for key in target.keys():
+            expand_key(target, key, context)
     return target
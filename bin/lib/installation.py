@@ -2,17 +2,20 @@ from __future__ import annotations
 
 import functools
 import glob
+import hashlib
+import heapq
 import logging
 import os
 import re
 import shutil
+import stat
 import subprocess
 import tempfile
 import time
-from collections import defaultdict, ChainMap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Sequence, Collection, List, Union, Dict, Any, IO, Callable
+from typing import Optional, Sequence, Collection, List, Union, Dict, Any, IO, Callable, Iterator, Set, Tuple
 
 import requests
 import requests.adapters
@@ -26,10 +29,22 @@ from lib.config_safe_loader import ConfigSafeLoader
 from lib.library_build_config import LibraryBuildConfig
 from lib.library_builder import LibraryBuilder
 
-VERSIONED_RE = re.compile(r'^(.*)-([0-9.]+)$')
+VERSIONED_RE = re.compile(r'(.*)-([0-9.]+)$')
 
 NO_DEFAULT = "__no_default__"
 
+STRIP_BATCH_SIZE = 64
+
+# Large reads keep the number of socket reads and pipe writes per download low
+FETCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Multi-threaded replacements for tar's built-in decompressors, in order of preference
+PARALLEL_DECOMPRESSORS = {
+    'z': ['pigz'],
+    'J': ['pixz', 'xz -T0'],
+    'j': ['lbzip2', 'pbzip2'],
+}
+
 logger = logging.getLogger(__name__)
 
 
@@ -38,20 +53,120 @@ class FetchFailure(RuntimeError):
 
 
 @functools.lru_cache(maxsize=1)
-def s3_available_compilers():
-    compilers = defaultdict(lambda: [])
+def s3_available_compilers() -> Dict[str, List[str]]:
+    compilers: Dict[str, List[str]] = {}
     for compiler in list_compilers():
+        if '-' not in compiler:
+            continue
         match = VERSIONED_RE.match(compiler)
         if match:
-            compilers[match.group(1)].append(match.group(2))
+            compilers.setdefault(match.group(1), []).append(match.group(2))
     return compilers
 
 
+@functools.lru_cache(maxsize=None)
+def _parallel_decompressor(decompress_flag: str) -> Optional[str]:
+    for program in PARALLEL_DECOMPRESSORS.get(decompress_flag, []):
+        if shutil.which(program.split()[0]):
+            return program
+    return None
+
+
+def untar_command(decompress_flag: str) -> List[str]:
+    program = _parallel_decompressor(decompress_flag)
+    if program:
+        return ['tar', '-I', program, '-xf', '-']
+    return ['tar', f'{decompress_flag}xf', '-']
+
+
+def _all_but_newest(versions: Collection[str], num_to_keep: int) -> List[str]:
+    return heapq.nsmallest(len(versions) - num_to_keep, versions)
+
+
+def _find_executables(path: str, seen_inodes: Set[Tuple[int, int]]) -> Iterator[str]:
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _find_executables(entry.path, seen_inodes)
+        elif entry.is_file(follow_symlinks=False):
+            st = entry.stat(follow_symlinks=False)
+            # hard links to one binary must only be stripped once: concurrent strips would share the inode
+            if st.st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) and \
+                    (st.st_dev, st.st_ino) not in seen_inodes:
+                seen_inodes.add((st.st_dev, st.st_ino))
+                yield entry.path
+
+
+def _scan_tree(root: str, prefix: str = '') -> Dict[str, tuple]:
+    entries: Dict[str, tuple] = {}
+    try:
+        dir_entries = list(os.scandir(os.path.join(root, prefix)))
+    except OSError:
+        # an unreadable directory never matches, as diff -r reported it as trouble
+        entries[prefix.rstrip(os.sep) or '.'] = ('unreadable',)
+        return entries
+    for entry in dir_entries:
+        relpath = prefix + entry.name
+        if entry.is_symlink():
+            entries[relpath] = ('link', os.readlink(entry.path))
+        elif entry.is_dir():
+            entries[relpath] = ('dir',)
+            entries.update(_scan_tree(root, relpath + os.sep))
+        else:
+            entries[relpath] = ('file', entry.stat().st_size)
+    return entries
+
+
+def _file_digest(path: str) -> Optional[bytes]:
+    hasher = hashlib.blake2b()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+    except OSError:
+        return None
+    return hasher.digest()
+
+
+def _compare_trees(left: str, right: str) -> List[str]:
+    left_entries = _scan_tree(left)
+    right_entries = _scan_tree(right)
+    differences = [f'Only in {left}: {path}' for path in sorted(left_entries.keys() - right_entries.keys())]
+    differences += [f'Only in {right}: {path}' for path in sorted(right_entries.keys() - left_entries.keys())]
+    # Only files that look the same from their sizes need their contents hashing
+    differing = []
+    to_hash = []
+    for path in left_entries.keys() & right_entries.keys():
+        if left_entries[path] != right_entries[path] or left_entries[path][0] == 'unreadable':
+            differing.append(path)
+        elif left_entries[path][0] == 'file':
+            to_hash.append(path)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        left_digests = executor.map(_file_digest, [os.path.join(left, path) for path in to_hash])
+        right_digests = executor.map(_file_digest, [os.path.join(right, path) for path in to_hash])
+        differing += [path for path, left_digest, right_digest in
+                      zip(to_hash, left_digests, right_digests) if left_digest is None or left_digest != right_digest]
+    return differences + [f'{path} differs' for path in sorted(differing)]
+
+
+def _make_writable_and_retry(func, path: str, exc_info) -> None:
+    # Some tar'd up GCCs are actually marked read-only, so make the parent directory writable and try again
+    if func not in (os.unlink, os.rmdir):
+        raise exc_info[1]
+    parent = os.path.dirname(path)
+    os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR)
+    func(path)
+
+
 class InstallationContext:
     def __init__(self, destination: Path, staging: Path, s3_url: str, dry_run: bool, is_nightly_enabled: bool,
                  cache: Optional[Path], yaml_dir: Path):
         self.destination = destination
         self.staging = staging
+        self._destination_prefix = os.path.join(str(destination), '')
         self.s3_url = s3_url
         self.dry_run = dry_run
         self.is_nightly_enabled = is_nightly_enabled
@@ -72,6 +187,10 @@ class InstallationContext:
             self.info("Making uncached requests")
             self.fetcher = http
         self.yaml_dir = yaml_dir
+        # Bumped whenever an installed directory is removed, which invalidates cached is_installed() results
+        self.dirs_removed = 0
+        # Values every target can refer to; built once so all yaml files in a run agree on "now"
+        self.target_base_config = dict(staging=staging, destination=destination, yaml_dir=yaml_dir, now=datetime.now())
 
     def debug(self, message: str) -> None:
         logger.debug(message)
@@ -88,8 +207,7 @@ class InstallationContext:
     def clean_staging(self) -> None:
         self.debug(f"Cleaning staging dir {self.staging}")
         if self.staging.is_dir():
-            subprocess.check_call(["chmod", "-R", "u+w", self.staging])
-            shutil.rmtree(self.staging, ignore_errors=True)
+            shutil.rmtree(self.staging, onerror=_make_writable_and_retry)
         self.debug(f"Recreating staging dir {self.staging}")
         self.staging.mkdir(parents=True)
 
@@ -108,7 +226,7 @@ class InstallationContext:
         self.info(f'Fetching {url} ({length} bytes)')
         report_every_secs = 5
         report_time = time.time() + report_every_secs
-        for chunk in request.iter_content(chunk_size=4 * 1024 * 1024):
+        for chunk in request.iter_content(chunk_size=FETCH_CHUNK_SIZE):
             fd.write(chunk)
             fetched += len(chunk)
             now = time.time()
@@ -122,13 +240,40 @@ class InstallationContext:
     def fetch_url_and_pipe_to(self, url: str, command: Sequence[str], subdir: Union[Path, str] = '.') -> None:
         untar_dir = self.staging / subdir
         untar_dir.mkdir(parents=True, exist_ok=True)
-        # We stream to a temporary file first before then piping this to the command
-        # as sometimes the command can take so long the URL endpoint closes the door on us
-        with tempfile.TemporaryFile() as fd:
-            self.fetch_to(url, fd)
-            fd.seek(0)
-            self.info(f'Piping to {" ".join(command)}')
-            subprocess.check_call(command, stdin=fd, cwd=str(untar_dir))
+        self.info(f'Piping to {" ".join(command)}')
+        try:
+            self._stream_url_to(url, command, untar_dir)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            # Sometimes the command can take so long the URL endpoint closes the door on us, so
+            # fall back to streaming to a temporary file first before then piping this to the command
+            self.warn(f'Streaming {url} failed ({e}), retrying via a temporary file')
+            # Throw away whatever the interrupted command managed to unpack
+            shutil.rmtree(untar_dir, onerror=_make_writable_and_retry)
+            untar_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryFile() as fd:
+                self.fetch_to(url, fd)
+                fd.seek(0)
+                subprocess.check_call(command, stdin=fd, cwd=str(untar_dir))
+
+    def _stream_url_to(self, url: str, command: Sequence[str], cwd: Path) -> None:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, cwd=str(cwd))
+        assert proc.stdin is not None
+        try:
+            self.fetch_to(url, proc.stdin)
+        except BrokenPipeError:
+            # The command exited before reading everything; its return code tells us why
+            pass
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = proc.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, command)
 
     def stage_command(self, command: Sequence[str], cwd: Optional[Path] = None) -> None:
         self.info(f'Staging with {" ".join(command)}')
@@ -141,7 +286,7 @@ class InstallationContext:
         (self.destination / subdir).mkdir(parents=True, exist_ok=True)
 
     def read_link(self, link: str) -> str:
-        return os.readlink(str(self.destination / link))
+        return os.readlink(self._destination_prefix + link)
 
     def set_link(self, source: Path, dest: str) -> None:
         if self.dry_run:
@@ -149,19 +294,24 @@ class InstallationContext:
             return
 
         full_dest = self.destination / dest
-        if full_dest.exists():
-            full_dest.unlink()
+        temp_dest = full_dest.with_name(f'{full_dest.name}.tmp')
+        temp_dest.unlink(missing_ok=True)
         self.info(f'Symlinking {dest} to {source}')
-        os.symlink(str(source), str(full_dest))
+        # Create alongside and rename over, so the link is swapped atomically and never missing
+        os.symlink(str(source), str(temp_dest))
+        os.replace(temp_dest, full_dest)
 
     def glob(self, pattern: str) -> Collection[str]:
-        return [os.path.relpath(x, str(self.destination)) for x in glob.glob(str(self.destination / pattern))]
+        # glob returns paths that start with the pattern's root, so no need for relpath's normalisation
+        prefix_len = len(self._destination_prefix)
+        return [x[prefix_len:] for x in glob.glob(self._destination_prefix + pattern)]
 
     def remove_dir(self, directory: Union[str, Path]) -> None:
         if self.dry_run:
             self.info(f'Would remove directory {directory} but in dry-run mode')
         else:
             shutil.rmtree(str(self.destination / directory), ignore_errors=True)
+            self.dirs_removed += 1
             self.info(f'Removing {directory}')
 
     def check_link(self, source: str, link: str) -> bool:
@@ -185,11 +335,13 @@ class InstallationContext:
         dest.parent.mkdir(parents=True, exist_ok=True)
         self.info(f'Moving from staging ({source}) to final destination ({dest})')
         if not source.is_dir():
-            staging_contents = subprocess.check_output(['ls', '-l', self.staging]).decode('utf-8')
+            with os.scandir(self.staging) as entries:
+                listing = sorted((entry.name, entry.stat(follow_symlinks=False)) for entry in entries)
+            staging_contents = '\n'.join(f'{stat.filemode(st.st_mode)} {st.st_size:>10} {name}' for name, st in listing)
             self.info(f"Directory listing of staging:\n{staging_contents}")
             raise RuntimeError(f"Missing source '{source}'")
         # Some tar'd up GCCs are actually marked read-only...
-        subprocess.check_call(["chmod", "u+w", source])
+        source.chmod(source.stat().st_mode | stat.S_IWUSR)
         state = ''
         if dest.is_dir():
             self.info(f'Destination {dest} exists, temporarily moving out of the way (to {existing_dir_rename})')
@@ -212,12 +364,17 @@ class InstallationContext:
         source = self.staging / source_str
         dest = self.destination / dest_str
         self.info(f'Comparing {source} vs {dest}...')
-        result = subprocess.call(['diff', '-r', source, dest])
-        if result == 0:
+        if not source.is_dir() or not dest.is_dir():
+            self.warn(f'Contents differ: both {source} and {dest} must be directories')
+            return False
+        differences = _compare_trees(str(source), str(dest))
+        for difference in differences:
+            self.info(difference)
+        if not differences:
             self.info('Contents match')
         else:
             self.warn('Contents differ')
-        return result == 0
+        return not differences
 
     def check_output(self, args: List[str], env: Optional[dict] = None, stderr_on_stdout=False) -> str:
         args = args[:]
@@ -242,19 +399,18 @@ class InstallationContext:
                 return
             paths = ['.']
         to_strip = []
+        seen_inodes: Set[Tuple[int, int]] = set()
         for path_part in paths:
             path = self.staging / path_part
             logger.debug("Looking for executables to strip in %s", path)
             if not path.is_dir():
                 raise RuntimeError(f"While looking for files to strip, {path} was not a directory")
-            for dirpath, _, filenames in os.walk(str(path)):
-                for filename in filenames:
-                    full_path = os.path.join(dirpath, filename)
-                    if os.access(full_path, os.X_OK):
-                        to_strip.append(full_path)
+            to_strip.extend(_find_executables(str(path), seen_inodes))
 
-        # Deliberately ignore errors
-        subprocess.call(['strip'] + to_strip)
+        batches = [to_strip[start:start + STRIP_BATCH_SIZE] for start in range(0, len(to_strip), STRIP_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # Deliberately ignore errors
+            list(executor.map(lambda batch: subprocess.call(['strip'] + batch), batches))
 
     def run_script(self, frompath: Union[str, Path], lines: List[str]) -> None:
         if len(lines) > 0:
@@ -281,7 +437,12 @@ class InstallationContext:
 
 
 class Installable:
+    __slots__ = ('install_context', 'config', 'target_name', 'context', 'name', 'is_library', 'language', 'depends',
+                 'install_always', '_check_link', '_installed_as_of', 'build_config', 'check_env', 'check_file',
+                 'check_call', 'check_stderr_on_stdout', 'install_path', 'after_stage_script')
+
     _check_link: Optional[Callable[[], bool]]
+    _installed_as_of: Optional[int]
     check_env: Dict
     check_file: Optional[str]
     check_call: List[str]
@@ -300,6 +461,7 @@ class Installable:
         self.depends = self.config.get('depends', [])
         self.install_always = self.config.get('install_always', False)
         self._check_link = None
+        self._installed_as_of = None
         self.build_config = LibraryBuildConfig(config)
         self.check_env = {}
         self.check_file = None
@@ -350,6 +512,8 @@ class Installable:
         return self.is_library and self.build_config.build_type != "manual" and self.build_config.build_type != "none" and self.build_config.build_type != ""
 
     def install(self) -> bool:
+        # Installing replaces whatever was there, so it needs checking again afterwards
+        self._installed_as_of = None
         self.debug("Ensuring dependees are installed")
         any_missing = False
         for dependee in self.depends:
@@ -362,6 +526,14 @@ class Installable:
         return True
 
     def is_installed(self) -> bool:
+        # Only a positive result is remembered, and only until something is removed from the destination
+        if self._installed_as_of != self.install_context.dirs_removed:
+            if not self._check_installed():
+                return False
+            self._installed_as_of = self.install_context.dirs_removed
+        return True
+
+    def _check_installed(self) -> bool:
         if self._check_link and not self._check_link():
             self.debug('Check link returned false')
             return False
@@ -386,7 +558,7 @@ class Installable:
             return False
 
     def config_get(self, config_key: str, default: Optional[Any] = None) -> Any:
-        if config_key not in self.config and default is None:
+        if default is None and config_key not in self.config:
             raise RuntimeError(f"Missing required key '{config_key}' in {self.name}")
         return self.config.get(config_key, default)
 
@@ -399,7 +571,7 @@ class Installable:
             (int(num) if num else 0, non) for num, non in re.findall(r'([0-9]+)|([^0-9]+)', self.target_name)
         ]
 
-    def build(self, buildfor):
+    def build(self, buildfor, jobs=1):
         if not self.is_library:
             raise RuntimeError('Nothing to build')
 
@@ -408,7 +580,7 @@ class Installable:
 
         sourcefolder = os.path.join(self.install_context.destination, self.install_path)
         builder = LibraryBuilder(logger, self.language, self.context[-1], self.target_name, sourcefolder,
-                                 self.install_context, self.build_config)
+                                 self.install_context, self.build_config, jobs)
 
         if self.build_config.build_type == "cmake":
             return builder.makebuild(buildfor)
@@ -442,6 +614,9 @@ def command_config(config: Union[List[str], str]) -> List[str]:
 
 
 class GitHubInstallable(Installable):
+    __slots__ = ('repo', 'domainurl', 'method', 'decompress_flag', 'strip', 'subdir', 'target_prefix', 'branch_name',
+                 'recursive', 'reponame', 'untar_dir')
+
     def __init__(self, install_context, config):
         super().__init__(install_context, config)
         last_context = self.context[-1]
@@ -450,10 +625,10 @@ class GitHubInstallable(Installable):
         self.method = self.config_get("method", "archive")
         self.decompress_flag = self.config_get("decompress_flag", "z")
         self.strip = False
-        self.subdir = os.path.join('libs', self.config_get("subdir", last_context))
+        self.subdir = f'libs/{self.config_get("subdir", last_context)}'
         self.target_prefix = self.config_get("target_prefix", "")
         self.branch_name = self.target_prefix + self.target_name
-        self.install_path = self.config_get('path_name', os.path.join(self.subdir, self.branch_name))
+        self.install_path = self.config_get('path_name', f'{self.subdir}/{self.branch_name}')
         if self.repo == "":
             raise RuntimeError('Requires repo')
         self.recursive = self.config_get("recursive", True)
@@ -466,11 +641,11 @@ class GitHubInstallable(Installable):
         check_file = self.config_get("check_file", "")
         if check_file == "":
             if self.build_config.build_type == "cmake":
-                self.check_file = os.path.join(self.install_path, 'CMakeLists.txt')
+                self.check_file = f'{self.install_path}/CMakeLists.txt'
             elif self.build_config.build_type == "make":
-                self.check_file = os.path.join(self.install_path, 'Makefile')
+                self.check_file = f'{self.install_path}/Makefile'
             elif self.build_config.build_type == "cake":
-                self.check_file = os.path.join(self.install_path, 'config.cake')
+                self.check_file = f'{self.install_path}/config.cake'
             else:
                 raise RuntimeError(f'Requires check_file ({last_context})')
         else:
@@ -478,16 +653,30 @@ class GitHubInstallable(Installable):
 
     def _update_args(self):
         if self.recursive:
-            return ['--recursive']
-        return []
+            return ['--recursive', '--jobs', '8']
+        return ['--jobs', '8']
+
+    def _shallow_clone(self, dest, clone_args):
+        # Only the tip is needed to build, so skip the history; fall back to a full clone if the ref can't be
+        # fetched shallowly (e.g. it names a commit rather than a branch or tag)
+        try:
+            subprocess.check_call(['git', 'clone', '-q', '--depth', '1'] + clone_args +
+                                  [f'{self.domainurl}/{self.repo}.git', dest], cwd=self.install_context.staging)
+            return True
+        except subprocess.CalledProcessError:
+            self.warn(f'Shallow clone of {self.repo} failed, retrying with full history')
+            shutil.rmtree(dest, ignore_errors=True)
+            return False
 
     def clone_branch(self):
         dest = os.path.join(self.install_context.destination, self.install_path)
         if not os.path.exists(dest):
-            subprocess.check_call(['git', 'clone', '-q', f'{self.domainurl}/{self.repo}.git', dest],
-                                  cwd=self.install_context.staging)
-            subprocess.check_call(['git', '-C', dest, 'checkout', '-q', self.branch_name],
-                                  cwd=self.install_context.staging)
+            # --no-single-branch keeps origin/HEAD and the other branch tips that the update path below relies on
+            if not self._shallow_clone(dest, ['--branch', self.branch_name, '--no-single-branch']):
+                subprocess.check_call(['git', 'clone', '-q', f'{self.domainurl}/{self.repo}.git', dest],
+                                      cwd=self.install_context.staging)
+                subprocess.check_call(['git', '-C', dest, 'checkout', '-q', self.branch_name],
+                                      cwd=self.install_context.staging)
         else:
             subprocess.check_call(['git', '-C', dest, 'fetch', '-q'], cwd=self.install_context.staging)
             subprocess.check_call(['git', '-C', dest, 'reset', '-q', '--hard', 'origin'],
@@ -505,8 +694,9 @@ class GitHubInstallable(Installable):
     def clone_default(self):
         dest = os.path.join(self.install_context.destination, self.install_path)
         if not os.path.exists(dest):
-            subprocess.check_call(['git', 'clone', '-q', f'{self.domainurl}/{self.repo}.git', dest],
-                                  cwd=self.install_context.staging)
+            if not self._shallow_clone(dest, []):
+                subprocess.check_call(['git', 'clone', '-q', f'{self.domainurl}/{self.repo}.git', dest],
+                                      cwd=self.install_context.staging)
         else:
             subprocess.check_call(['git', '-C', dest, 'fetch', '-q'], cwd=self.install_context.staging)
             subprocess.check_call(['git', '-C', dest, 'reset', '-q', '--hard', 'origin'],
@@ -519,7 +709,7 @@ class GitHubInstallable(Installable):
         return f'{self.domainurl}/{self.repo}/archive/{self.target_prefix}{self.target_name}.tar.gz'
 
     def get_archive_pipecommand(self):
-        return ['tar', f'{self.decompress_flag}xf', '-']
+        return untar_command(self.decompress_flag)
 
     def stage(self):
         self.install_context.clean_staging()
@@ -559,6 +749,8 @@ class GitHubInstallable(Installable):
 
 
 class GitLabInstallable(GitHubInstallable):
+    __slots__ = ()
+
     def __init__(self, install_context, config):
         super().__init__(install_context, config)
         self.domainurl = self.config_get("domainurl", "https://gitlab.com")
@@ -571,6 +763,8 @@ class GitLabInstallable(GitHubInstallable):
 
 
 class BitbucketInstallable(GitHubInstallable):
+    __slots__ = ()
+
     def __init__(self, install_context, config):
         super().__init__(install_context, config)
         self.domainurl = self.config_get("domainurl", "https://bitbucket.org")
@@ -583,6 +777,8 @@ class BitbucketInstallable(GitHubInstallable):
 
 
 class S3TarballInstallable(Installable):
+    __slots__ = ('subdir', 'untar_dir', 's3_path', 'decompress_flag', 'strip')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.subdir = self.config_get("subdir", "")
@@ -615,7 +811,7 @@ class S3TarballInstallable(Installable):
 
     def stage(self) -> None:
         self.install_context.clean_staging()
-        self.install_context.fetch_s3_and_pipe_to(self.s3_path, ['tar', f'{self.decompress_flag}xf', '-'])
+        self.install_context.fetch_s3_and_pipe_to(self.s3_path, untar_command(self.decompress_flag))
         if self.strip:
             self.install_context.strip_exes(self.strip)
 
@@ -644,6 +840,8 @@ class S3TarballInstallable(Installable):
 
 
 class NightlyInstallable(Installable):
+    __slots__ = ('subdir', 'strip', 's3_path', 'compiler_pattern', 'path_name_symlink', 'num_to_keep')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.subdir = self.config_get("subdir", "")
@@ -664,7 +862,7 @@ class NightlyInstallable(Installable):
 
     def stage(self) -> None:
         self.install_context.clean_staging()
-        self.install_context.fetch_s3_and_pipe_to(f'{self.s3_path}.tar.xz', ['tar', 'Jxf', '-'])
+        self.install_context.fetch_s3_and_pipe_to(f'{self.s3_path}.tar.xz', untar_command('J'))
         if self.strip:
             self.install_context.strip_exes(self.strip)
         self.install_context.run_script(os.path.join(self.install_context.staging, self.s3_path),
@@ -686,8 +884,7 @@ class NightlyInstallable(Installable):
 
         # Do this first, and add one for the file we haven't yet installed... (then dry run works)
         num_to_keep = self.num_to_keep + 1
-        all_versions = list(sorted(self.install_context.glob(self.compiler_pattern)))
-        for to_remove in all_versions[:-num_to_keep]:
+        for to_remove in _all_but_newest(self.install_context.glob(self.compiler_pattern), num_to_keep):
             self.install_context.remove_dir(to_remove)
 
         self.install_context.move_from_staging(self.s3_path, self.install_path)
@@ -700,6 +897,9 @@ class NightlyInstallable(Installable):
 
 
 class TarballInstallable(Installable):
+    __slots__ = ('install_path_symlink', 'untar_path', 'untar_to', 'url', 'configure_command', 'tar_cmd', 'strip',
+                 'remove_older_pattern', 'num_to_keep')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.install_path = self.config_get('dir')
@@ -721,7 +921,7 @@ class TarballInstallable(Installable):
         else:
             raise RuntimeError(f'Unknown compression {self.config_get("compression")}')
         self.configure_command = command_config(self.config_get('configure_command', []))
-        self.tar_cmd = ['tar', f'{decompress_flag}xf', '-']
+        self.tar_cmd = untar_command(decompress_flag)
         strip_components = self.config_get("strip_components", 0)
         if strip_components:
             self.tar_cmd += ['--strip-components', str(strip_components)]
@@ -760,8 +960,7 @@ class TarballInstallable(Installable):
         if self.remove_older_pattern:
             # Do this first, and add one for the file we haven't yet installed... (then dry run works)
             num_to_keep = self.num_to_keep + 1
-            all_versions = list(sorted(self.install_context.glob(self.remove_older_pattern)))
-            for to_remove in all_versions[:-num_to_keep]:
+            for to_remove in _all_but_newest(self.install_context.glob(self.remove_older_pattern), num_to_keep):
                 self.install_context.remove_dir(to_remove)
 
         self.install_context.move_from_staging(self.untar_path, self.install_path)
@@ -774,6 +973,8 @@ class TarballInstallable(Installable):
 
 
 class ZipArchiveInstallable(Installable):
+    __slots__ = ('url', 'folder_to_rename', 'configure_command', 'strip')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.install_path = self.config_get('dir')
@@ -816,6 +1017,8 @@ class ZipArchiveInstallable(Installable):
 
 
 class RestQueryTarballInstallable(TarballInstallable):
+    __slots__ = ()
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         document = self.install_context.fetch_rest_query(self.config_get('url'))
@@ -836,6 +1039,8 @@ class RestQueryTarballInstallable(TarballInstallable):
 
 
 class ScriptInstallable(Installable):
+    __slots__ = ('install_path_symlink', 'fetch', 'script', 'strip')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.install_path = self.config_get('dir')
@@ -888,6 +1093,8 @@ def s3_available_rust_artifacts(prefix):
 
 
 class RustInstallable(Installable):
+    __slots__ = ('base_package', 'nightly_install_days')
+
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
         super().__init__(install_context, config)
         self.install_path = self.config_get('dir')
@@ -898,7 +1105,7 @@ class RustInstallable(Installable):
     def do_rust_install(self, component: str, install_to: Path) -> None:
         url = f'https://static.rust-lang.org/dist/{component}.tar.gz'
         untar_to = self.install_context.staging / '__temp_install__'
-        self.install_context.fetch_url_and_pipe_to(url, ['tar', 'zxf', '-', '--strip-components=1'], untar_to)
+        self.install_context.fetch_url_and_pipe_to(url, untar_command('z') + ['--strip-components=1'], untar_to)
         self.install_context.stage_command(
             ['./install.sh', f'--prefix={install_to}', '--verbose', '--without=rust-docs'], cwd=untar_to)
         self.install_context.remove_dir(untar_to)
@@ -952,6 +1159,8 @@ class RustInstallable(Installable):
 
 
 class PipInstallable(Installable):
+    __slots__ = ('package', 'python')
+
     MV_URL = 'https://raw.githubusercontent.com/brbsix/virtualenv-mv/master/virtualenv-mv'
 
     def __init__(self, install_context: InstallationContext, config: Dict[str, Any]):
@@ -1038,7 +1247,7 @@ def _targets_from(node, enabled, context, name, base_config):
                 raise RuntimeError(f"Target {target} was parsed as a float. Enclose in quotes")
             if isinstance(target, str):
                 target = {'name': target}
-            yield expand_target(ChainMap(target, base_config), context)
+            yield expand_target({**base_config, **target}, context)
 
 
 INSTALLER_TYPES = {
@@ -1057,9 +1266,7 @@ INSTALLER_TYPES = {
 
 
 def installers_for(install_context, nodes, enabled):
-    for target in targets_from(nodes, enabled,
-                               dict(staging=install_context.staging, destination=install_context.destination,
-                                    yaml_dir=install_context.yaml_dir, now=datetime.now())):
+    for target in targets_from(nodes, enabled, install_context.target_base_config):
         assert 'type' in target
         target_type = target['type']
         if target_type not in INSTALLER_TYPES:
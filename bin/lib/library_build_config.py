@@ -20,6 +20,6 @@ class LibraryBuildConfig:
         self.skip_compilers = self.config_get("skip_compilers", [])
 
     def config_get(self, config_key: str, default: Optional[Any] = None) -> Any:
-        if config_key not in self.config and default is None:
+        if default is None and config_key not in self.config:
             raise RuntimeError(f"Missing required key '{config_key}'")
         return self.config.get(config_key, default)
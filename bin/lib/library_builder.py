@@ -1,23 +1,31 @@
+import functools
 import glob
 import hashlib
 import itertools
 import json
+import logging
+import math
 import os
 import re
 import shutil
 import subprocess
 import tempfile
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum, unique
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 import requests
+import requests.adapters
 
 from lib.amazon import get_ssm_param
 from lib.amazon_properties import get_specific_library_version_details, get_properties_compilers_and_libraries
 from lib.binary_info import BinaryInfo
 from lib.library_build_config import LibraryBuildConfig
 
+logger = logging.getLogger(__name__)
+
 build_supported_os = ['Linux']
 build_supported_buildtype = ['Debug']
 build_supported_arch = ['x86_64', 'x86']
@@ -32,11 +40,71 @@ disable_clang_libcpp = ['clang30', 'clang31', 'clang32', 'clang33', 'clang341',
 disable_clang_32bit = disable_clang_libcpp.copy()
 disable_clang_libcpp += ['clang_lifetime']
 
-_propsandlibs: Dict[str, Any] = defaultdict(lambda: [])
-_supports_x86: Dict[str, Any] = defaultdict(lambda: [])
+_compiler_support: Dict[Tuple[str, str, str, str, str], bool] = {}
+
+# (property, build config attribute) pairs copied from the amazon properties; later ones win, so a library's
+# name takes precedence over its description
+LIBRARY_PROPS_TO_BUILDCONFIG = (('description', 'description'), ('name', 'description'), ('url', 'url'),
+                                ('staticliblink', 'staticliblink'), ('liblink', 'sharedliblink'))
+VERSION_PROPS_TO_BUILDCONFIG = (('staticliblink', 'staticliblink'), ('liblink', 'sharedliblink'))
 
 GITCOMMITHASH_RE = re.compile(r'^(\w*)\s.*')
 CONANINFOHASH_RE = re.compile(r'\s+ID:\s(\w*)')
+GCC_TOOLCHAIN_RE = re.compile(r'--gcc-toolchain=(\S*)')
+GXX_NAME_RE = re.compile(r'--gxx-name=(\S*)')
+STDVER_RE = re.compile(r'-std=(\S*)')
+STDLIB_RE = re.compile(r'-stdlib=(\S*)')
+TARGET_RE = re.compile(r'-target (\S*)')
+
+
+@functools.lru_cache(maxsize=None)
+def _toolchain_layout(toolchain: str) -> Tuple[bool, bool]:
+    # (has lib64, has lib32)
+    return os.path.exists(f'{toolchain}/lib64'), os.path.exists(f'{toolchain}/lib32')
+
+
+@functools.lru_cache(maxsize=None)
+def _source_has_file(sourcefolder: str, filename: str) -> bool:
+    return os.path.exists(os.path.join(sourcefolder, filename))
+
+
+@functools.lru_cache(maxsize=None)
+def _buildhash_prefix(compiler, options, toolchain, buildos, buildtype, arch):
+    # Shared by every stdver/stdlib/flags combination; callers must copy() before updating
+    hasher = hashlib.sha256()
+    hasher.update(bytes(f'{compiler},{options},{toolchain},{buildos},{buildtype},{arch},', 'utf-8'))
+    return hasher
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler_target_help(exe, compilerType, ldPath):
+    fullenv = dict(os.environ, LD_LIBRARY_PATH=ldPath)
+
+    if compilerType == "":
+        helparg = '--help' if 'icc' in exe else '--target-help'
+        return subprocess.check_output([exe, helparg], env=fullenv).decode('utf-8', 'ignore')
+    elif compilerType == "clang":
+        folder = os.path.dirname(exe)
+        llcexe = os.path.join(folder, 'llc')
+        if os.path.exists(llcexe):
+            try:
+                return subprocess.check_output([llcexe, '--version'], env=fullenv).decode('utf-8', 'ignore')
+            except subprocess.CalledProcessError as e:
+                return e.output.decode('utf-8', 'ignore')
+    return ""
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler_can_compile(exe, language, options, ldPath):
+    # If a compiler can't build an empty translation unit, every combination of the build matrix fails the same way
+    langarg = 'c' if language == 'c' else 'c++'
+    fullenv = dict(os.environ, LD_LIBRARY_PATH=ldPath)
+    try:
+        subprocess.check_call([exe, *options.split(), '-x', langarg, '-c', '-o', os.devnull, os.devnull], env=fullenv,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        return True
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return False
 
 
 @unique
@@ -52,9 +120,23 @@ build_timeout = 600
 conanserver_url = "https://conan.compiler-explorer.com"
 
 
+@functools.lru_cache(maxsize=None)
+def _compilers_and_libraries(language: str) -> List[Dict[str, Any]]:
+    return get_properties_compilers_and_libraries(language, logger)
+
+
+@functools.lru_cache(maxsize=1)
+def conanserver_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=3)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class LibraryBuilder:
     def __init__(self, logger, language: str, libname: str, target_name: str, sourcefolder: str, install_context,
-                 buildconfig: LibraryBuildConfig):
+                 buildconfig: LibraryBuildConfig, jobs: int = 1):
         self.logger = logger
         self.language = language
         self.libname = libname
@@ -63,41 +145,45 @@ class LibraryBuilder:
         self.sourcefolder = sourcefolder
         self.target_name = target_name
         self.forcebuild = False
-        self.current_buildparameters_obj: Dict[str, Any] = defaultdict(lambda: [])
-        self.current_buildparameters: List[str] = []
+        self.jobs = max(1, jobs)
+        self.parallel_builds = 1
+        # Build combinations may run concurrently, so the conan settings of the one being built are per-thread,
+        # and anything touching the local conan cache or the proxy login is serialised
+        self._buildstate = threading.local()
+        self._conan_lock = threading.Lock()
         self.needs_uploading = 0
         self.libid = self.libname  # TODO: CE libid might be different from yaml libname
         self.conanserverproxy_token = None
 
-        if self.language in _propsandlibs:
-            [self.compilerprops, self.libraryprops] = _propsandlibs[self.language]
-        else:
-            [self.compilerprops, self.libraryprops] = get_properties_compilers_and_libraries(self.language, self.logger)
-            _propsandlibs[self.language] = [self.compilerprops, self.libraryprops]
+        [self.compilerprops, self.libraryprops] = _compilers_and_libraries(self.language)
 
         self.completeBuildConfig()
 
-    def completeBuildConfig(self):
-        if 'description' in self.libraryprops[self.libid]:
-            self.buildconfig.description = self.libraryprops[self.libid]['description']
-        if 'name' in self.libraryprops[self.libid]:
-            self.buildconfig.description = self.libraryprops[self.libid]['name']
-        if 'url' in self.libraryprops[self.libid]:
-            self.buildconfig.url = self.libraryprops[self.libid]['url']
+    @property
+    def current_buildparameters_obj(self) -> Dict[str, Any]:
+        if not hasattr(self._buildstate, 'obj'):
+            self._buildstate.obj = defaultdict(lambda: [])
+        return self._buildstate.obj
+
+    @property
+    def current_buildparameters(self) -> List[str]:
+        return getattr(self._buildstate, 'params', [])
 
-        if 'staticliblink' in self.libraryprops[self.libid]:
-            self.buildconfig.staticliblink = self.libraryprops[self.libid]['staticliblink']
+    @current_buildparameters.setter
+    def current_buildparameters(self, params: List[str]):
+        self._buildstate.params = params
 
-        if 'liblink' in self.libraryprops[self.libid]:
-            self.buildconfig.sharedliblink = self.libraryprops[self.libid]['liblink']
+    def completeBuildConfig(self):
+        libraryprops = self.libraryprops.get(self.libid, {})
+        for prop, attr in LIBRARY_PROPS_TO_BUILDCONFIG:
+            if prop in libraryprops:
+                setattr(self.buildconfig, attr, libraryprops[prop])
 
         specificVersionDetails = get_specific_library_version_details(self.libraryprops, self.libid, self.target_name)
         if specificVersionDetails:
-            if 'staticliblink' in specificVersionDetails:
-                self.buildconfig.staticliblink = specificVersionDetails['staticliblink']
-
-            if 'liblink' in specificVersionDetails:
-                self.buildconfig.sharedliblink = specificVersionDetails['liblink']
+            for prop, attr in VERSION_PROPS_TO_BUILDCONFIG:
+                if prop in specificVersionDetails:
+                    setattr(self.buildconfig, attr, specificVersionDetails[prop])
 
         if self.buildconfig.lib_type == "static":
             if self.buildconfig.staticliblink == []:
@@ -117,67 +203,56 @@ class LibraryBuilder:
         self.buildconfig.staticliblink += alternatelibs
 
     def getToolchainPathFromOptions(self, options):
-        match = re.search(r"--gcc-toolchain=(\S*)", options)
+        match = GCC_TOOLCHAIN_RE.search(options)
         if match:
             return match[1]
         else:
-            match = re.search(r"--gxx-name=(\S*)", options)
+            match = GXX_NAME_RE.search(options)
             if match:
                 return os.path.realpath(os.path.join(os.path.dirname(match[1]), ".."))
         return False
 
     def getStdVerFromOptions(self, options):
-        match = re.search(r"-std=(\S*)", options)
+        match = STDVER_RE.search(options)
         if match:
             return match[1]
         return False
 
     def getStdLibFromOptions(self, options):
-        match = re.search(r"-stdlib=(\S*)", options)
+        match = STDLIB_RE.search(options)
         if match:
             return match[1]
         return False
 
     def getTargetFromOptions(self, options):
-        match = re.search(r"-target (\S*)", options)
+        match = TARGET_RE.search(options)
         if match:
             return match[1]
         return False
 
     def does_compiler_support(self, exe, compilerType, arch, options, ldPath):
+        cachekey = (exe, compilerType, arch, options, ldPath)
+        if cachekey not in _compiler_support:
+            _compiler_support[cachekey] = self._probe_compiler_support(exe, compilerType, arch, options, ldPath)
+        return _compiler_support[cachekey]
+
+    def _probe_compiler_support(self, exe, compilerType, arch, options, ldPath):
         fixedTarget = self.getTargetFromOptions(options)
         if fixedTarget:
             return fixedTarget == arch
 
-        fullenv = os.environ
-        fullenv['LD_LIBRARY_PATH'] = ldPath
-
         if compilerType == "":
             if 'icpx' in exe:
                 return arch == 'x86' or arch == 'x86_64'
             elif 'icc' in exe:
-                output = subprocess.check_output([exe, '--help'], env=fullenv).decode('utf-8', 'ignore')
                 if arch == 'x86':
                     arch = "-m32"
                 elif arch == 'x86_64':
                     arch = "-m64"
-            else:
-                if 'zapcc' in exe:
-                    return arch == 'x86' or arch == 'x86_64'
-                else:
-                    output = subprocess.check_output([exe, '--target-help'], env=fullenv).decode('utf-8', 'ignore')
-        elif compilerType == "clang":
-            folder = os.path.dirname(exe)
-            llcexe = os.path.join(folder, 'llc')
-            if os.path.exists(llcexe):
-                try:
-                    output = subprocess.check_output([llcexe, '--version'], env=fullenv).decode('utf-8', 'ignore')
-                except subprocess.CalledProcessError as e:
-                    output = e.output.decode('utf-8', 'ignore')
-            else:
-                output = ""
-        else:
-            output = ""
+            elif 'zapcc' in exe:
+                return arch == 'x86' or arch == 'x86_64'
+
+        output = _compiler_target_help(exe, compilerType, ldPath)
 
         if arch in output:
             self.logger.debug(f'Compiler {exe} supports {arch}')
@@ -187,10 +262,7 @@ class LibraryBuilder:
             return False
 
     def does_compiler_support_x86(self, exe, compilerType, options, ldPath):
-        cachekey = f'{exe}|{options}'
-        if cachekey not in _supports_x86:
-            _supports_x86[cachekey] = self.does_compiler_support(exe, compilerType, 'x86', options, ldPath)
-        return _supports_x86[cachekey]
+        return self.does_compiler_support(exe, compilerType, 'x86', options, ldPath)
 
     def replace_optional_arg(self, arg, name, value):
         optional = '%' + name + '?%'
@@ -225,130 +297,139 @@ class LibraryBuilder:
                          toolchain, buildos, buildtype, arch, stdver, stdlib, flagscombination, ldPath):
         scriptfile = os.path.join(buildfolder, "build.sh")
 
-        with open(scriptfile, 'w') as f:
-            f.write('#!/bin/sh\n\n')
-            compilerexecc = compilerexe[:-2]
-            if compilerexe.endswith('clang++'):
-                compilerexecc = f'{compilerexecc}'
-            elif compilerexe.endswith('g++'):
-                compilerexecc = f'{compilerexecc}cc'
-
-            f.write(f'export CC={compilerexecc}\n')
-            f.write(f'export CXX={compilerexe}\n')
-
-            libparampaths = []
-            archflag = ''
-            if arch == '':
-                # note: native arch for the compiler, so most of the time 64, but not always
-                if os.path.exists(f'{toolchain}/lib64'):
-                    libparampaths.append(f'{toolchain}/lib64')
-                    libparampaths.append(f'{toolchain}/lib')
-                else:
-                    libparampaths.append(f'{toolchain}/lib')
-            elif arch == 'x86':
+        compilerexecc = compilerexe[:-2]
+        if compilerexe.endswith('clang++'):
+            compilerexecc = f'{compilerexecc}'
+        elif compilerexe.endswith('g++'):
+            compilerexecc = f'{compilerexecc}cc'
+
+        has_lib64, has_lib32 = _toolchain_layout(toolchain)
+        libparampaths = []
+        archflag = ''
+        if arch == '':
+            # note: native arch for the compiler, so most of the time 64, but not always
+            if has_lib64:
+                libparampaths.append(f'{toolchain}/lib64')
                 libparampaths.append(f'{toolchain}/lib')
-                if os.path.exists(f'{toolchain}/lib32'):
-                    libparampaths.append(f'{toolchain}/lib32')
-
-                if compilerType == 'clang':
-                    archflag = '-m32'
-                elif compilerType == '':
-                    archflag = '-march=i386 -m32'
-
-            rpathflags = ''
-            ldflags = ''
-            for path in libparampaths:
-                rpathflags += f'-Wl,-rpath={path} '
-
-            for path in libparampaths:
-                ldflags += f'-L{path} '
-
-            ldlibpathsstr = ldPath
-            f.write(f'export LD_LIBRARY_PATHS="{ldlibpathsstr}"\n')
-            f.write(f'export LDFLAGS="{ldflags} {rpathflags}"\n')
-            f.write('export NUMCPUS="$(nproc)"\n')
-
-            stdverflag = ''
-            if stdver != '':
-                stdverflag = f'-std={stdver}'
-
-            stdlibflag = ''
-            if stdlib != '' and compilerType == 'clang':
-                libcxx = stdlib
-                stdlibflag = f'-stdlib={stdlib}'
-                if stdlibflag in compileroptions:
-                    stdlibflag = ''
             else:
-                libcxx = "libstdc++"
+                libparampaths.append(f'{toolchain}/lib')
+        elif arch == 'x86':
+            libparampaths.append(f'{toolchain}/lib')
+            if has_lib32:
+                libparampaths.append(f'{toolchain}/lib32')
+
+            if compilerType == 'clang':
+                archflag = '-m32'
+            elif compilerType == '':
+                archflag = '-march=i386 -m32'
+
+        rpathflags = ''
+        ldflags = ''
+        for path in libparampaths:
+            rpathflags += f'-Wl,-rpath={path} '
+
+        for path in libparampaths:
+            ldflags += f'-L{path} '
+
+        ldlibpathsstr = ldPath
+
+        stdverflag = ''
+        if stdver != '':
+            stdverflag = f'-std={stdver}'
+
+        stdlibflag = ''
+        if stdlib != '' and compilerType == 'clang':
+            libcxx = stdlib
+            stdlibflag = f'-stdlib={stdlib}'
+            if stdlibflag in compileroptions:
+                stdlibflag = ''
+        else:
+            libcxx = "libstdc++"
 
-            extraflags = ' '.join(x for x in flagscombination)
+        extraflags = ' '.join(flagscombination)
 
-            if compilerType == "":
-                compilerTypeOrGcc = "gcc"
+        if compilerType == "":
+            compilerTypeOrGcc = "gcc"
+        else:
+            compilerTypeOrGcc = compilerType
+
+        cxx_flags = f'{compileroptions} {archflag} {stdverflag} {stdlibflag} {rpathflags} {extraflags}'
+
+        expanded_configure_flags = [self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib)
+                                    for
+                                    arg in self.buildconfig.configure_flags]
+        configure_flags = ' '.join(expanded_configure_flags)
+
+        lines = [
+            '#!/bin/sh',
+            '',
+            f'export CC={compilerexecc}',
+            f'export CXX={compilerexe}',
+            f'export LD_LIBRARY_PATHS="{ldlibpathsstr}"',
+            f'export LDFLAGS="{ldflags} {rpathflags}"',
+        ]
+        if self.parallel_builds > 1:
+            # the other builds running alongside this one share the cores
+            share = f'$(nproc) / {self.parallel_builds}'
+            lines.append(f'export NUMCPUS="$(( {share} > 1 ? {share} : 1 ))"')
+        else:
+            lines.append('export NUMCPUS="$(nproc)"')
+
+        if self.buildconfig.build_type == "cmake":
+            expanded_cmake_args = [self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib) for
+                                   arg
+                                   in self.buildconfig.extra_cmake_arg]
+            extracmakeargs = ' '.join(expanded_cmake_args)
+            if compilerTypeOrGcc == "clang" and "--gcc-toolchain=" not in compileroptions:
+                toolchainparam = ""
             else:
-                compilerTypeOrGcc = compilerType
+                toolchainparam = f'"-DCMAKE_CXX_COMPILER_EXTERNAL_TOOLCHAIN={toolchain}"'
+            cmakeline = f'cmake -DCMAKE_BUILD_TYPE={buildtype} {toolchainparam} "-DCMAKE_CXX_FLAGS_DEBUG={cxx_flags}" {extracmakeargs} {sourcefolder} > cecmakelog.txt 2>&1'
+            self.logger.debug(cmakeline)
+            lines.append(cmakeline)
+        else:
+            if _source_has_file(sourcefolder, 'Makefile'):
+                lines.append('make clean')
+            lines.append('rm -f *.so*')
+            lines.append('rm -f *.a')
+            lines.append(f'export CXXFLAGS="{cxx_flags}"')
+            if self.buildconfig.build_type == "make":
+                if _source_has_file(sourcefolder, 'configure'):
+                    lines.append(f'./configure {configure_flags} > ceconfiglog.txt 2>&1')
+
+        lines.extend(self.buildconfig.prebuild_script)
+
+        extramakeargs = ' '.join(['-j$NUMCPUS'] + [
+            self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib)
+            for arg in self.buildconfig.extra_make_arg
+        ])
+
+        if len(self.buildconfig.make_targets) != 0:
+            for lognum, target in enumerate(self.buildconfig.make_targets):
+                lines.append(f'make {extramakeargs} {target} > cemakelog_{lognum}.txt 2>&1')
+        else:
+            lognum = 0
+            for lib in itertools.chain(self.buildconfig.staticliblink, self.buildconfig.sharedliblink):
+                lines.append(f'make {extramakeargs} {lib} > cemakelog_{lognum}.txt 2>&1')
+                lognum += 1
 
-            cxx_flags = f'{compileroptions} {archflag} {stdverflag} {stdlibflag} {rpathflags} {extraflags}'
+            if len(self.buildconfig.staticliblink) != 0:
+                lines.append('libsfound=$(find . -iname \'lib*.a\')')
+            elif len(self.buildconfig.sharedliblink) != 0:
+                lines.append('libsfound=$(find . -iname \'lib*.so*\')')
 
-            expanded_configure_flags = [self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib)
-                                        for
-                                        arg in self.buildconfig.configure_flags]
-            configure_flags = ' '.join(expanded_configure_flags)
+            lines.append('if [ "$libsfound" = "" ]; then')
+            lines.append(f'  make {extramakeargs} all > cemakelog_{lognum}.txt 2>&1')
+            lines.append('fi')
 
-            if self.buildconfig.build_type == "cmake":
-                expanded_cmake_args = [self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib) for
-                                       arg
-                                       in self.buildconfig.extra_cmake_arg]
-                extracmakeargs = ' '.join(expanded_cmake_args)
-                if compilerTypeOrGcc == "clang" and "--gcc-toolchain=" not in compileroptions:
-                    toolchainparam = ""
-                else:
-                    toolchainparam = f'"-DCMAKE_CXX_COMPILER_EXTERNAL_TOOLCHAIN={toolchain}"'
-                cmakeline = f'cmake -DCMAKE_BUILD_TYPE={buildtype} {toolchainparam} "-DCMAKE_CXX_FLAGS_DEBUG={cxx_flags}" {extracmakeargs} {sourcefolder} > cecmakelog.txt 2>&1\n'
-                self.logger.debug(cmakeline)
-                f.write(cmakeline)
-            else:
-                if os.path.exists(os.path.join(sourcefolder, 'Makefile')):
-                    f.write('make clean\n')
-                f.write('rm -f *.so*\n')
-                f.write('rm -f *.a\n')
-                f.write(f'export CXXFLAGS="{cxx_flags}"\n')
-                if self.buildconfig.build_type == "make":
-                    configurepath = os.path.join(sourcefolder, 'configure')
-                    if os.path.exists(configurepath):
-                        f.write(f'./configure {configure_flags} > ceconfiglog.txt 2>&1\n')
-
-            for line in self.buildconfig.prebuild_script:
-                f.write(f'{line}\n')
-
-            extramakeargs = ' '.join(['-j$NUMCPUS'] + [
-                self.expand_make_arg(arg, compilerTypeOrGcc, buildtype, arch, stdver, stdlib)
-                for arg in self.buildconfig.extra_make_arg
-            ])
-
-            if len(self.buildconfig.make_targets) != 0:
-                for lognum, target in enumerate(self.buildconfig.make_targets):
-                    f.write(f'make {extramakeargs} {target} > cemakelog_{lognum}.txt 2>&1\n')
-            else:
-                lognum = 0
-                for lib in itertools.chain(self.buildconfig.staticliblink, self.buildconfig.sharedliblink):
-                    f.write(f'make {extramakeargs} {lib} > cemakelog_{lognum}.txt 2>&1\n')
-                    lognum += 1
-
-                if len(self.buildconfig.staticliblink) != 0:
-                    f.write('libsfound=$(find . -iname \'lib*.a\')\n')
-                elif len(self.buildconfig.sharedliblink) != 0:
-                    f.write('libsfound=$(find . -iname \'lib*.so*\')\n')
-
-                f.write('if [ "$libsfound" = "" ]; then\n')
-                f.write(f'  make {extramakeargs} all > cemakelog_{lognum}.txt 2>&1\n')
-                f.write('fi\n')
+        for lib in self.buildconfig.staticliblink:
+            lines.append(f'find . -iname \'lib{lib}*.a\' -type f -exec mv {{}} . \\;')
 
-            for lib in self.buildconfig.staticliblink:
-                f.write(f'find . -iname \'lib{lib}*.a\' -type f -exec mv {{}} . \\;\n')
+        for lib in self.buildconfig.sharedliblink:
+            lines.append(f'find . -iname \'lib{lib}*.so*\' -type f,l -exec mv {{}} . \\;')
 
-            for lib in self.buildconfig.sharedliblink:
-                f.write(f'find . -iname \'lib{lib}*.so*\' -type f,l -exec mv {{}} . \\;\n')
+        with open(scriptfile, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
 
         subprocess.check_call(['/bin/chmod', '+x', scriptfile])
 
@@ -381,48 +462,43 @@ class LibraryBuilder:
         scriptfile = os.path.join(buildfolder, "conanexport.sh")
         conanparamsstr = ' '.join(self.current_buildparameters)
 
-        f = open(scriptfile, 'w')
-        f.write('#!/bin/sh\n\n')
-        f.write(f'conan export-pkg . {self.libname}/{self.target_name} -f {conanparamsstr}\n')
-        f.close()
+        with open(scriptfile, 'w') as f:
+            f.write(f'#!/bin/sh\n\nconan export-pkg . {self.libname}/{self.target_name} -f {conanparamsstr}\n')
         subprocess.check_call(['/bin/chmod', '+x', scriptfile])
 
     def writeconanfile(self, buildfolder):
         scriptfile = os.path.join(buildfolder, "conanfile.py")
 
-        libsum = ''
-        for lib in self.buildconfig.staticliblink:
-            libsum += f'"{lib}",'
-
-        for lib in self.buildconfig.sharedliblink:
-            libsum += f'"{lib}",'
-
-        libsum = libsum[:-1]
-
-        f = open(scriptfile, 'w')
-        f.write('from conans import ConanFile, tools\n')
-        f.write(f'class {self.libname}Conan(ConanFile):\n')
-        f.write(f'    name = "{self.libname}"\n')
-        f.write(f'    version = "{self.target_name}"\n')
-        f.write('    settings = "os", "compiler", "build_type", "arch", "stdver", "flagcollection"\n')
-        f.write(f'    description = "{self.buildconfig.description}"\n')
-        f.write(f'    url = "{self.buildconfig.url}"\n')
-        f.write('    license = "None"\n')
-        f.write('    author = "None"\n')
-        f.write('    topics = None\n')
-        f.write('    def package(self):\n')
+        libsum = ','.join(f'"{lib}"' for lib in itertools.chain(self.buildconfig.staticliblink,
+                                                                 self.buildconfig.sharedliblink))
+
+        lines = [
+            'from conans import ConanFile, tools',
+            f'class {self.libname}Conan(ConanFile):',
+            f'    name = "{self.libname}"',
+            f'    version = "{self.target_name}"',
+            '    settings = "os", "compiler", "build_type", "arch", "stdver", "flagcollection"',
+            f'    description = "{self.buildconfig.description}"',
+            f'    url = "{self.buildconfig.url}"',
+            '    license = "None"',
+            '    author = "None"',
+            '    topics = None',
+            '    def package(self):',
+        ]
 
         for lib in self.buildconfig.staticliblink:
-            f.write(f'        self.copy("lib{lib}*.a", dst="lib", keep_path=False)\n')
+            lines.append(f'        self.copy("lib{lib}*.a", dst="lib", keep_path=False)')
 
         for lib in self.buildconfig.sharedliblink:
-            f.write(f'        self.copy("lib{lib}*.so*", dst="lib", keep_path=False)\n')
+            lines.append(f'        self.copy("lib{lib}*.so*", dst="lib", keep_path=False)')
 
         for copyline in self.buildconfig.package_extra_copy:
-            f.write(f'        {copyline}\n')
-        f.write('    def package_info(self):\n')
-        f.write(f'        self.cpp_info.libs = [{libsum}]\n')
-        f.close()
+            lines.append(f'        {copyline}')
+        lines.append('    def package_info(self):')
+        lines.append(f'        self.cpp_info.libs = [{libsum}]')
+
+        with open(scriptfile, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
 
     def executeconanscript(self, buildfolder, arch, stdlib):
         filesfound = 0
@@ -476,11 +552,9 @@ class LibraryBuilder:
             return BuildStatus.TimedOut
 
     def makebuildhash(self, compiler, options, toolchain, buildos, buildtype, arch, stdver, stdlib, flagscombination):
-        hasher = hashlib.sha256()
-        flagsstr = '|'.join(x for x in flagscombination)
-        hasher.update(
-            bytes(f'{compiler},{options},{toolchain},{buildos},{buildtype},{arch},{stdver},{stdlib},{flagsstr}',
-                  'utf-8'))
+        hasher = _buildhash_prefix(compiler, options, toolchain, buildos, buildtype, arch).copy()
+        flagsstr = '|'.join(flagscombination)
+        hasher.update(bytes(f'{stdver},{stdlib},{flagsstr}', 'utf-8'))
 
         self.logger.info(
             f'Building {self.libname} for [{compiler},{options},{toolchain},{buildos},{buildtype},{arch},{stdver},{stdlib},{flagsstr}]')
@@ -504,7 +578,7 @@ class LibraryBuilder:
         login_body = defaultdict(lambda: [])
         login_body['password'] = get_ssm_param('/compiler-explorer/conanpwd')
 
-        request = requests.post(url, data=json.dumps(login_body), headers={"Content-Type": "application/json"})
+        request = conanserver_session().post(url, data=json.dumps(login_body), headers={"Content-Type": "application/json"})
         if not request.ok:
             self.logger.info(request.text)
             raise RuntimeError(f'Post failure for {url}: {request}')
@@ -541,7 +615,7 @@ class LibraryBuilder:
 
         headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.conanserverproxy_token}
 
-        request = requests.post(url, data=json.dumps(buildparameters_copy), headers=headers)
+        request = conanserver_session().post(url, data=json.dumps(buildparameters_copy), headers=headers)
         if not request.ok:
             raise RuntimeError(f'Post failure for {url}: {request}')
 
@@ -552,7 +626,7 @@ class LibraryBuilder:
 
         url = f'{conanserver_url}/annotations/{self.libname}/{self.target_name}/{conanhash}'
         with tempfile.TemporaryFile() as fd:
-            request = requests.get(url, stream=True)
+            request = conanserver_session().get(url, stream=True)
             if not request.ok:
                 raise RuntimeError(f'Fetch failure for {url}: {request}')
             for chunk in request.iter_content(chunk_size=4 * 1024 * 1024):
@@ -579,7 +653,7 @@ class LibraryBuilder:
         headers = {"Content-Type": "application/json"}
 
         url = f'{conanserver_url}/hasfailedbefore'
-        request = requests.post(url, data=json.dumps(self.current_buildparameters_obj), headers=headers)
+        request = conanserver_session().post(url, data=json.dumps(self.current_buildparameters_obj), headers=headers)
         if not request.ok:
             raise RuntimeError(f'Post failure for {url}: {request}')
         else:
@@ -623,7 +697,7 @@ class LibraryBuilder:
         headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.conanserverproxy_token}
 
         url = f'{conanserver_url}/annotations/{self.libname}/{self.target_name}/{conanhash}'
-        request = requests.post(url, data=json.dumps(annotations), headers=headers)
+        request = conanserver_session().post(url, data=json.dumps(annotations), headers=headers)
         if not request.ok:
             raise RuntimeError(f'Post failure for {url}: {request}')
 
@@ -649,7 +723,9 @@ class LibraryBuilder:
             self.logger.info("Build has failed before, not re-attempting")
             return BuildStatus.Skipped
 
-        if self.is_already_uploaded(build_folder):
+        with self._conan_lock:
+            already_uploaded = self.is_already_uploaded(build_folder)
+        if already_uploaded:
             self.logger.info("Build already uploaded")
             if not self.forcebuild:
                 return BuildStatus.Skipped
@@ -657,17 +733,20 @@ class LibraryBuilder:
         if requires_tree_copy:
             shutil.copytree(self.sourcefolder, build_folder, dirs_exist_ok=True)
 
-        if not self.install_context.dry_run and not self.conanserverproxy_token:
-            self.conanproxy_login()
+        if not self.install_context.dry_run:
+            with self._conan_lock:
+                if not self.conanserverproxy_token:
+                    self.conanproxy_login()
 
         build_status = self.executebuildscript(build_folder)
         if build_status == BuildStatus.Ok:
             self.writeconanscript(build_folder)
             if not self.install_context.dry_run:
-                build_status = self.executeconanscript(build_folder, arch, stdlib)
-                if build_status == BuildStatus.Ok:
-                    self.needs_uploading += 1
-                    self.set_as_uploaded(build_folder)
+                with self._conan_lock:
+                    build_status = self.executeconanscript(build_folder, arch, stdlib)
+                    if build_status == BuildStatus.Ok:
+                        self.needs_uploading += 1
+                        self.set_as_uploaded(build_folder)
 
         if not self.install_context.dry_run:
             self.save_build_logging(build_status, build_folder)
@@ -716,7 +795,8 @@ class LibraryBuilder:
             if not (checkcompiler in self.compilerprops):
                 self.logger.error(f'Unknown compiler {checkcompiler}')
 
-        for compiler in self.compilerprops:
+        combinations = []
+        for compiler, compilerprops in self.compilerprops.items():
             if checkcompiler != "" and compiler != checkcompiler:
                 continue
 
@@ -724,12 +804,12 @@ class LibraryBuilder:
                 self.logger.info(f'Skipping {compiler}')
                 continue
 
-            if 'compilerType' in self.compilerprops[compiler]:
-                compilerType = self.compilerprops[compiler]['compilerType']
+            if 'compilerType' in compilerprops:
+                compilerType = compilerprops['compilerType']
             else:
                 raise RuntimeError(f'Something is wrong with {compiler}')
 
-            exe = self.compilerprops[compiler]['exe']
+            exe = compilerprops['exe']
 
             if buildfor == "allclang" and compilerType != "clang":
                 continue
@@ -738,7 +818,8 @@ class LibraryBuilder:
             elif buildfor == "allgcc" and compilerType != "":
                 continue
 
-            options = self.compilerprops[compiler]['options']
+            options = compilerprops['options']
+            ldPath = compilerprops['ldPath']
 
             toolchain = self.getToolchainPathFromOptions(options)
             fixedStdver = self.getStdVerFromOptions(options)
@@ -776,16 +857,14 @@ class LibraryBuilder:
             else:
                 if self.buildconfig.build_fixed_arch != "":
                     if not self.does_compiler_support(exe, compilerType, self.buildconfig.build_fixed_arch,
-                                                      self.compilerprops[compiler]['options'],
-                                                      self.compilerprops[compiler]['ldPath']):
+                                                      options, ldPath):
                         self.logger.debug(
                             f'Compiler {compiler} does not support fixed arch {self.buildconfig.build_fixed_arch}')
                         continue
                     else:
                         archs = [self.buildconfig.build_fixed_arch]
 
-                if not self.does_compiler_support_x86(exe, compilerType, self.compilerprops[compiler]['options'],
-                                                      self.compilerprops[compiler]['ldPath']):
+                if not self.does_compiler_support_x86(exe, compilerType, options, ldPath):
                     archs = ['']
 
             if buildfor == "nonx86" and archs[0] != "":
@@ -795,19 +874,38 @@ class LibraryBuilder:
             if fixedStdver:
                 stdvers = [fixedStdver]
 
-            for args in itertools.product(
-                    build_supported_os, build_supported_buildtype, archs, stdvers, stdlibs,
-                    build_supported_flagscollection):
-                buildstatus = self.makebuildfor(compiler, options, exe, compilerType, toolchain,
-                                                *args, self.compilerprops[compiler]['ldPath'])
-                if buildstatus == BuildStatus.Ok:
-                    builds_succeeded = builds_succeeded + 1
-                elif buildstatus == BuildStatus.Skipped:
-                    builds_skipped = builds_skipped + 1
-                else:
-                    builds_failed = builds_failed + 1
+            matrix = (build_supported_os, build_supported_buildtype, archs, stdvers, stdlibs,
+                      build_supported_flagscollection)
+
+            if compilerType in ('', 'clang') and not _compiler_can_compile(exe, self.language, options, ldPath):
+                numcombinations = math.prod(len(dimension) for dimension in matrix)
+                self.logger.warning(f'{compiler} cannot compile an empty file, skipping {numcombinations} builds')
+                builds_skipped = builds_skipped + numcombinations
+                continue
 
-            if builds_succeeded > 0:
-                self.upload_builds()
+            combinations += [(compiler, options, exe, compilerType, toolchain, *args, ldPath)
+                             for args in itertools.product(*matrix)]
+
+        self.parallel_builds = max(1, min(self.jobs, len(combinations)))
+        with ThreadPoolExecutor(max_workers=self.parallel_builds) as executor:
+            # each combination builds in its own hash-named staging folder, so they can run side by side
+            futures = [executor.submit(self.makebuildfor, *combination) for combination in combinations]
+            try:
+                buildstatuses = [future.result() for future in as_completed(futures)]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        for buildstatus in buildstatuses:
+            if buildstatus == BuildStatus.Ok:
+                builds_succeeded = builds_succeeded + 1
+            elif buildstatus == BuildStatus.Skipped:
+                builds_skipped = builds_skipped + 1
+            else:
+                builds_failed = builds_failed + 1
+
+        if builds_succeeded > 0:
+            self.upload_builds()
 
         return [builds_succeeded, builds_skipped, builds_failed]
@@ -1,4 +1,5 @@
 import logging
+from unittest.mock import MagicMock, patch
 
 from lib.amazon_properties import get_properties_compilers_and_libraries, get_specific_library_version_details
 
@@ -30,6 +31,36 @@ def test_googletest_should_have_versions():
     details = get_specific_library_version_details(_libraries, 'googletest', 'release-1.10.0')
     assert details != False
 
+def test_should_parse_groups_compilers_and_libraries():
+    properties = """
+compilers=&gcc86
+group.gcc86.compilers=g1:g2:&gccsub
+group.gcc86.options=-O1
+group.gccsub.compilers=g3
+group.gccsub.ldPath=/lib
+compiler.g1.exe=/bin/sh
+compiler.g2.exe=/does/not/exist
+compiler.g3.exe=/bin/sh
+compiler.g3.options=-O3
+libs=gt
+libs.gt.staticliblink=gtestd:gmockd
+libs.gt.versions.110.version=1.10.0
+"""
+    response = MagicMock(ok=True)
+    response.iter_lines.return_value = properties.splitlines()
+    with patch('lib.amazon_properties.properties_session') as session:
+        session.return_value.get.return_value = response
+        [_compilers, _libraries] = get_properties_compilers_and_libraries('c++', logger)
+
+    assert sorted(_compilers) == ['g1', 'g3']
+    assert _compilers['g1'] == {'options': '-O1', 'compilerType': '', 'supportsBinary': True, 'ldPath': '',
+                                'group': 'gcc86', 'exe': '/bin/sh'}
+    assert _compilers['g3']['options'] == '-O3'
+    assert _compilers['g3']['ldPath'] == '/lib'
+    assert _libraries['gt']['staticliblink'] == ['gtestd', 'gmockd']
+    assert get_specific_library_version_details(_libraries, 'gt', '1.10.0') == {'version': '1.10.0'}
+    assert not get_specific_library_version_details(_libraries, 'unknown', '1.10.0')
+
 # def test_should_not_contain_g412():
 #     [_compilers, _libraries] = get_properties_compilers_and_libraries('c++', logger)
 #     assert not 'g412' in _compilers
@@ -1,10 +1,13 @@
-from unittest.mock import MagicMock
+import os
+import subprocess
+from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 import yaml
 
 from lib.config_safe_loader import ConfigSafeLoader
-from lib.installation import targets_from, Installable, InstallationContext
+from lib.installation import targets_from, Installable, InstallationContext, _compare_trees
 
 
 def parse_targets(string_config, enabled=None):
@@ -71,6 +74,22 @@ compilers:
     """)
 
 
+def test_long_reference_chains():
+    [target] = parse_targets("""
+compilers:
+  a: "{b}/a"
+  b: "{c}/b"
+  c: "{d}/c"
+  d: "{e}/d"
+  e: "{f}/e"
+  f: "{g}/f"
+  g: "{name}"
+  targets:
+    - 5.4.0
+    """)
+    assert target['a'] == "5.4.0/f/e/d/c/b/a"
+
+
 def test_numbers_at_root():
     [target] = parse_targets("""
 compilers:
@@ -155,3 +174,123 @@ def test_installable_sort(fake_context):
     assert sorted([v10_1, v10_1_alpha, ab_c, v1_2_3, v10_2], key=lambda x: x.sort_key) == [
         v1_2_3, v10_1, v10_1_alpha, v10_2, ab_c
     ]
+
+
+def test_installable_remembers_being_installed(fake_context):
+    fake_context.dirs_removed = 0
+    installable = Installable(fake_context, dict(context=[], name="1.0"))
+    installable.check_call = ['bin/foo', '--version']
+    fake_context.check_output.side_effect = FileNotFoundError
+    assert not installable.is_installed()
+    assert not installable.is_installed()
+    assert fake_context.check_output.call_count == 2
+
+    fake_context.check_output.side_effect = None
+    assert installable.is_installed()
+    assert installable.is_installed()
+    assert fake_context.check_output.call_count == 3
+
+    fake_context.dirs_removed += 1
+    fake_context.check_output.side_effect = FileNotFoundError
+    assert not installable.is_installed()
+    assert fake_context.check_output.call_count == 4
+
+
+def test_strip_exes_strips_each_hard_linked_binary_once(tmp_path):
+    (tmp_path / 'bin').mkdir()
+    (tmp_path / 'bin' / 'g++').write_text('binary')
+    (tmp_path / 'bin' / 'g++').chmod(0o755)
+    os.link(tmp_path / 'bin' / 'g++', tmp_path / 'bin' / 'c++')
+    (tmp_path / 'bin' / 'readme').write_text('text')
+    context = InstallationContext.__new__(InstallationContext)
+    context.staging = tmp_path
+    with patch('lib.installation.subprocess.call') as call:
+        context.strip_exes(True)
+    [stripped] = [args[0][1:] for args, _ in call.call_args_list]
+    assert len(stripped) == 1
+    assert os.path.basename(stripped[0]) in ('g++', 'c++')
+
+
+def piping_context(tmp_path, *payloads):
+    context = InstallationContext.__new__(InstallationContext)
+    context.staging = tmp_path
+    fetches = iter(payloads)
+
+    def fake_fetch_to(_url, fd):
+        payload = next(fetches)
+        if isinstance(payload, Exception):
+            (tmp_path / 'sub' / 'partial').write_text('half unpacked')
+            raise payload
+        fd.write(payload)
+
+    context.fetch_to = fake_fetch_to
+    return context
+
+
+def test_fetch_url_and_pipe_to_streams_to_command(tmp_path):
+    context = piping_context(tmp_path, b'some data')
+    context.fetch_url_and_pipe_to('https://example.com/data', ['sh', '-c', 'cat > out'], 'sub')
+    assert (tmp_path / 'sub' / 'out').read_bytes() == b'some data'
+
+
+def test_fetch_url_and_pipe_to_raises_when_command_fails(tmp_path):
+    context = piping_context(tmp_path, b'some data')
+    with pytest.raises(subprocess.CalledProcessError):
+        context.fetch_url_and_pipe_to('https://example.com/data', ['false'])
+
+
+def test_fetch_url_and_pipe_to_tolerates_command_exiting_early(tmp_path):
+    context = piping_context(tmp_path, b'x' * (16 * 1024 * 1024))
+    context.fetch_url_and_pipe_to('https://example.com/data', ['true'])
+    context = piping_context(tmp_path, b'x' * (16 * 1024 * 1024))
+    with pytest.raises(subprocess.CalledProcessError):
+        context.fetch_url_and_pipe_to('https://example.com/data', ['false'])
+
+
+def test_fetch_url_and_pipe_to_retries_via_temporary_file(tmp_path):
+    context = piping_context(tmp_path, requests.exceptions.ConnectionError('reset'), b'some data')
+    context.fetch_url_and_pipe_to('https://example.com/data', ['sh', '-c', 'cat > out'], 'sub')
+    assert sorted(os.listdir(tmp_path / 'sub')) == ['out']
+    assert (tmp_path / 'sub' / 'out').read_bytes() == b'some data'
+
+
+def test_compare_trees(tmp_path):
+    left, right = tmp_path / 'left', tmp_path / 'right'
+    for root in (left, right):
+        (root / 'lib').mkdir(parents=True)
+        (root / 'same').write_text('same')
+        (root / 'lib' / 'same.so').write_text('same')
+        (root / 'link').symlink_to('same')
+    assert _compare_trees(str(left), str(right)) == []
+
+    (left / 'only-left').write_text('left')
+    (right / 'only-right').write_text('right')
+    (left / 'size').write_text('short')
+    (right / 'size').write_text('much longer')
+    (left / 'lib' / 'content').write_text('aaaa')
+    (right / 'lib' / 'content').write_text('bbbb')
+    (right / 'link').unlink()
+    (right / 'link').symlink_to('size')
+    assert _compare_trees(str(left), str(right)) == [
+        f'Only in {left}: only-left',
+        f'Only in {right}: only-right',
+        'lib/content differs',
+        'link differs',
+        'size differs',
+    ]
+
+
+def test_compare_trees_reports_unreadable_directories(tmp_path, monkeypatch):
+    left, right = tmp_path / 'left', tmp_path / 'right'
+    for root in (left, right):
+        (root / 'lib').mkdir(parents=True)
+        (root / 'lib' / 'same.so').write_text('same')
+    real_scandir = os.scandir
+
+    def scandir(path):
+        if path == os.path.join(str(right), 'lib/'):
+            raise PermissionError(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr('lib.installation.os.scandir', scandir)
+    assert _compare_trees(str(left), str(right)) == [f'Only in {left}: lib/same.so', 'lib differs']
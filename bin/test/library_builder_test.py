@@ -0,0 +1,67 @@
+import logging
+import threading
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+from lib.library_build_config import LibraryBuildConfig
+from lib.library_builder import LibraryBuilder, BuildStatus
+
+logger = logging.getLogger()
+
+
+def make_builder(compilers, jobs):
+    with patch('lib.library_builder._compilers_and_libraries', return_value=[compilers, {}]):
+        return LibraryBuilder(logger, 'c++', 'fmt', '1.0.0', '/tmp/fmt', MagicMock(),
+                              LibraryBuildConfig(dict(build_type='make')), jobs)
+
+
+@patch('lib.library_builder._compiler_can_compile', return_value=True)
+def test_makebuild_runs_combinations_in_parallel(_):
+    compilers = {
+        'clang1': dict(compilerType='clang', exe='/opt/clang1/bin/clang++', options='', ldPath=''),
+        'clang2': dict(compilerType='clang', exe='/opt/clang2/bin/clang++', options='', ldPath=''),
+    }
+    builder = make_builder(compilers, jobs=4)
+    builder.does_compiler_support_x86 = lambda *args: True
+
+    # each compiler has 4 combinations (2 archs x 2 stdlibs), which all have to be in flight at once to get past this
+    all_in_flight = threading.Barrier(4, timeout=10)
+    mixed_up = []
+
+    def fake_makebuildfor(compiler, options, exe, compiler_type, toolchain, buildos, buildtype, arch, stdver, stdlib,
+                          flagscombination, ld_path):
+        builder.setCurrentConanBuildParameters(buildos, buildtype, compiler_type, compiler, stdlib, arch, stdver, '')
+        all_in_flight.wait()
+        if builder.current_buildparameters_obj['arch'] != arch or f'arch={arch}' not in builder.current_buildparameters:
+            mixed_up.append((compiler, arch, stdlib))
+        if arch == 'x86':
+            return BuildStatus.Skipped
+        return BuildStatus.Ok if stdlib == '' else BuildStatus.Failed
+
+    builder.makebuildfor = fake_makebuildfor
+    assert builder.makebuild('forceall') == [2, 4, 2]
+    assert mixed_up == []
+    assert builder.parallel_builds == 4
+
+
+@patch('lib.library_builder._compiler_can_compile', return_value=True)
+def test_makebuild_stops_queued_builds_when_one_raises(_):
+    compilers = {
+        'gcc1': dict(compilerType='', exe='/opt/gcc1/bin/g++', options='', ldPath=''),
+        'gcc2': dict(compilerType='', exe='/opt/gcc2/bin/g++', options='', ldPath=''),
+    }
+    builder = make_builder(compilers, jobs=1)
+    builder.does_compiler_support_x86 = lambda *args: True
+    calls = []
+
+    def fake_makebuildfor(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError('conan went away')
+        return BuildStatus.Ok
+
+    builder.makebuildfor = fake_makebuildfor
+    with pytest.raises(RuntimeError, match='conan went away'):
+        builder.makebuild('forceall')
+    assert len(calls) < 4